@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+""" Builds a matrix of settings and options of the OpenSSL recipe concurrently.
+
+    The matrix file is JSON (or YAML when PyYAML is installed), every combination of the
+    listed values is built:
+
+        {"settings": {"build_type": ["Release", "Debug"], "arch": ["x86_64"]},
+         "options": {"shared": [true, false], "no_zlib": [false]}}
+
+    Each build gets CONAN_CPU_COUNT=jobs_per_build (used by the recipe 'jobs=auto' option),
+    so concurrency * jobs_per_build keeps the cores of the machine busy without oversubscribing.
+    Combinations already in the local cache are skipped.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+here = os.path.dirname(os.path.abspath(__file__))
+recipe_name = "OpenSSL"
+recipe_version = "1.0.2p"
+
+
+def load_matrix(path):
+    with open(path) as matrix_file:
+        if path.endswith((".yml", ".yaml")):
+            import yaml  # Optional, only needed for YAML matrices
+            return yaml.safe_load(matrix_file)
+        return json.load(matrix_file)
+
+
+def expand_matrix(matrix):
+    axes = [("-s", name, values) for name, values in sorted(matrix.get("settings", {}).items())]
+    axes += [("-o", "%s:%s" % (recipe_name, name), values) for name, values in sorted(matrix.get("options", {}).items())]
+    for values in itertools.product(*[axis_values for _, _, axis_values in axes]):
+        yield [(flag, name, value) for (flag, name, _), value in zip(axes, values)]
+
+
+def conan_args(combination, profile):
+    args = ["-pr", profile] if profile else []
+    for flag, name, value in combination:
+        args += [flag, "%s=%s" % (name, value)]
+    return args
+
+
+def describe(combination):
+    return " ".join("%s=%s" % (name.split(":")[-1], value) for _, name, value in combination)
+
+
+def package_info(reference, args):
+    """ Returns the package ID and folder conan computes for the combination """
+    info_folder = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(info_folder, "info.json")
+        subprocess.check_output(["conan", "info", reference, "--paths", "--json", json_path] + args,
+                                stderr=subprocess.STDOUT)
+        with open(json_path) as info_file:
+            nodes = json.load(info_file)
+    finally:
+        shutil.rmtree(info_folder, ignore_errors=True)
+    node = [node for node in nodes if node["reference"] == reference][0]
+    return node["id"], node.get("package_folder")
+
+
+def folder_size(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                size += os.path.getsize(path)
+    return size
+
+
+def build(reference, combination, profile, jobs, logs_folder):
+    args = conan_args(combination, profile)
+    result = {"combination": describe(combination), "package_id": "-", "seconds": 0.0, "size": 0}
+    try:
+        package_id, package_folder = package_info(reference, args)
+    except subprocess.CalledProcessError as exc:
+        # Typically the recipe configure() rejecting the combination
+        lines = exc.output.decode("utf-8", "replace").strip().splitlines()
+        result["status"] = "invalid (%s)" % (lines[-1] if lines else "conan info failed")
+        return result
+    except Exception as exc:
+        result["status"] = "FAILED (%s)" % exc
+        return result
+    result["package_id"] = package_id
+    if package_folder and os.path.exists(os.path.join(package_folder, "conaninfo.txt")):
+        result.update(status="cached", size=folder_size(package_folder))
+        return result
+
+    env = dict(os.environ, CONAN_CPU_COUNT=str(jobs))
+    log_path = os.path.join(logs_folder, "%s.log" % package_id)
+    start = time.time()
+    with open(log_path, "w") as log:
+        # The recipe was exported once by main(), building from the reference keeps concurrent builds
+        # from re-exporting it under each other
+        returncode = subprocess.call(["conan", "install", reference, "--build=%s" % recipe_name, "--build=missing"]
+                                     + args, env=env, stdout=log, stderr=subprocess.STDOUT)
+    result["seconds"] = time.time() - start
+    result["status"] = "ok" if returncode == 0 else "FAILED (%s)" % log_path
+    result["size"] = folder_size(package_folder) if returncode == 0 and package_folder else 0
+    return result
+
+
+def print_summary(results):
+    print("%-40s %10s %8s %s" % ("package id", "time (s)", "size(MB)", "status / combination"))
+    for result in results:
+        print("%-40s %10.1f %8.2f %s  %s" % (result["package_id"], result["seconds"], result["size"] / 1e6,
+                                             result["status"], result["combination"]))
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %s" % value)
+    return number
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("matrix", help="JSON or YAML file with the settings and options to combine")
+    parser.add_argument("--user-channel", default="user/testing", help="user/channel of the created packages")
+    parser.add_argument("--profile", help="conan profile used for every build")
+    parser.add_argument("--concurrency", type=positive_int, default=2, help="builds running at the same time")
+    parser.add_argument("--jobs-per-build", type=positive_int, help="make jobs of each build, default cores / concurrency")
+    parser.add_argument("--logs", default=os.path.join(here, "build_matrix_logs"), help="folder for the build logs")
+    args = parser.parse_args(argv)
+
+    jobs = args.jobs_per_build or max(cpu_count() // args.concurrency, 1)
+    reference = "%s/%s@%s" % (recipe_name, recipe_version, args.user_channel)
+    if not os.path.isdir(args.logs):
+        os.makedirs(args.logs)
+    subprocess.check_call(["conan", "export", here, args.user_channel])
+
+    combinations = list(expand_matrix(load_matrix(args.matrix)))
+    print("Building %d combinations, %d at a time with %d jobs each" % (len(combinations), args.concurrency, jobs))
+    pool = ThreadPool(args.concurrency)
+    try:
+        results = pool.map(lambda combination: build(reference, combination, args.profile, jobs, args.logs),
+                           combinations)
+    finally:
+        pool.close()
+    print_summary(results)
+    return 0 if all(not result["status"].startswith("FAILED") for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,18 @@
 from conans import ConanFile, AutoToolsBuildEnvironment
 from conans import tools
 from conans import __version__ as client_version
+import glob
+import hashlib
+import json
 import os
+import re
+import shlex
+import shutil
+import socket
+import subprocess
+import time
+from collections import deque
+from contextlib import contextmanager
 
 from conans.model.version import Version
 
@@ -36,11 +47,39 @@ class OpenSSLConan(ConanFile):
                "no_rsa": [True, False],
                "no_sha": [True, False]}
     default_options = "=False\n".join(options.keys()) + "=False\n zlib:shared=False"
+    # Options handled by the recipe itself, never forwarded to ./Configure: name -> (values, default)
+    recipe_options = {"jobs": ("ANY", "auto"),
+                      "compiler_cache": (["none", "ccache", "sccache"], "none"),
+                      "pgo": ([True, False], False),
+                      "lto": ([True, False], False),
+                      "benchmark": ([True, False], False),
+                      "libs_only": ([True, False], False),
+                      "cpu_tuning": ("ANY", "baseline"),
+                      "ec_nistp_64_gcc_128": ([True, False], False),
+                      "minimal": ([True, False], False),
+                      "link_footprint": ([True, False], False),
+                      "clean_build": ([True, False], False)}
+    # Features removed by the minimal preset: option -> (./Configure switches, symbol that must be gone).
+    # "auto" follows the preset, True/False override it
+    minimal_features = {"no_ssl2": ("no-ssl2", "SSLv2_method"),
+                        "no_ssl3": ("no-ssl3 no-ssl3-method", "SSLv3_method"),
+                        "no_comp": ("no-comp", "COMP_CTX_new"),
+                        "no_engine": ("no-engine", "ENGINE_new"),
+                        "no_heartbeats": ("no-heartbeats", "tls1_heartbeat"),
+                        "no_srp": ("no-srp", "SRP_VBASE_new"),
+                        "no_idea": ("no-idea", "EVP_idea_cbc"),
+                        "no_seed": ("no-seed", "EVP_seed_cbc"),
+                        "no_camellia": ("no-camellia", "EVP_camellia_128_cbc"),
+                        "no_whirlpool": ("no-whirlpool", "EVP_whirlpool")}
+    recipe_options.update({name: ([True, False, "auto"], "auto") for name in minimal_features})
+    options.update({name: values for name, (values, _) in recipe_options.items()})
+    default_options += "".join("\n%s=%s" % (name, default) for name, (_, default) in recipe_options.items())
     exports_sources = "*.tar.gz"
 
     # When a new version is available they move the tar.gz to old/ location
     source_tgz = "https://www.openssl.org/source/openssl-%s.tar.gz" % version
     source_tgz_old = "https://www.openssl.org/source/old/1.0.2/openssl-%s.tar.gz" % version
+    source_sha256 = "50a98e07b1a89eb8f6a99477f262df71c6fa7bef77df4dc83025a2845c827d00"
 
     def build_requirements(self):
         # useful for example for conditional build_requires
@@ -50,15 +89,111 @@ class OpenSSLConan(ConanFile):
                 self.build_requires("nasm/2.13.01@snow-crash/testing")
 
     def source(self):
-        tools.unzip("openssl-1.0.2p.tar.gz")
-        tools.check_sha256("openssl-1.0.2p.tar.gz",
-                           "50a98e07b1a89eb8f6a99477f262df71c6fa7bef77df4dc83025a2845c827d00")
-        os.unlink("openssl-1.0.2p.tar.gz")
+        tarball = "openssl-%s.tar.gz" % self.version
+        tools.rmdir(self.subfolder)  # re-running 'conan source' in a local folder
+        shutil.copytree(self.cached_source_tree(tarball), self.subfolder, symlinks=True)
+        if os.path.exists(tarball):
+            os.unlink(tarball)
+
+    @property
+    def source_cache(self):
+        default = os.path.join(tools.get_env("CONAN_USER_HOME", os.path.expanduser("~")), ".conan", "openssl-sources")
+        return tools.get_env("OPENSSL_SOURCE_CACHE", default)
+
+    def cached_source_tree(self, tarball):
+        """ Extracted sources from a cache keyed by the tarball SHA-256 (OPENSSL_SOURCE_CACHE).
+            On a miss the tarball is taken from the exported sources, the OPENSSL_SOURCE_MIRROR
+            folder or downloaded, and verified before anything is extracted
+        """
+        entry = os.path.join(self.source_cache, self.source_sha256)
+        tree = os.path.join(entry, self.subfolder)
+        if os.path.isdir(tree):
+            self.output.info("Using cached sources %s" % tree)
+            return tree
+
+        staging = os.path.join(entry, "staging-%d" % os.getpid())
+        tools.rmdir(staging)
+        os.makedirs(staging)
+        try:
+            archive = self.fetch_source_tarball(tarball, staging)
+            sha256 = self.file_sha256(archive)
+            if sha256 != self.source_sha256:
+                raise Exception("%s has SHA-256 %s, expected %s" % (archive, sha256, self.source_sha256))
+            tools.unzip(archive, staging)
+            try:
+                os.rename(os.path.join(staging, self.subfolder), tree)
+            except OSError:
+                if not os.path.isdir(tree):  # else a concurrent build already filled the cache
+                    raise
+        finally:
+            tools.rmdir(staging)
+        return tree
+
+    def fetch_source_tarball(self, tarball, folder):
+        if os.path.exists(tarball):
+            return tarball
+        mirror = tools.get_env("OPENSSL_SOURCE_MIRROR")
+        if mirror and os.path.exists(os.path.join(mirror, tarball)):
+            return os.path.join(mirror, tarball)
+        archive = os.path.join(folder, tarball)
+        for url in [self.source_tgz, self.source_tgz_old]:
+            try:
+                tools.download(url, archive, overwrite=True)
+                return archive
+            except Exception as exc:
+                self.output.warn("Could not download %s: %s" % (url, exc))
+        raise Exception("Could not find %s in the exported sources, a mirror or the OpenSSL site" % tarball)
+
+    @staticmethod
+    def file_sha256(path):
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as archive:
+            for chunk in iter(lambda: archive.read(1 << 20), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
 
     def configure(self):
         if client_version < Version("1.0.0"):
             raise Exception("This recipe only works with Conan client >= 1.0.0")
         del self.settings.compiler.libcxx
+        if self.options.pgo and (self.settings.os != "Linux" or self.settings.compiler not in ["clang", "gcc"]):
+            raise Exception("Option pgo is only supported for Linux builds with gcc or clang")
+        if self.options.lto and (self.settings.os != "Linux" or self.settings.compiler not in ["clang", "gcc"]):
+            raise Exception("Option lto is only supported for Linux builds with gcc or clang")
+        if self.options.cpu_tuning != "baseline":
+            if self.settings.os != "Linux" or self.settings.compiler not in ["clang", "gcc"]:
+                raise Exception("Option cpu_tuning is only supported for Linux builds with gcc or clang")
+            if str(self.options.cpu_tuning).startswith("x86-64-") and self.settings.arch != "x86_64":
+                raise Exception("cpu_tuning=%s needs arch=x86_64" % self.options.cpu_tuning)
+        if self.options.link_footprint and (self.settings.os != "Linux" or
+                                            self.settings.compiler not in ["clang", "gcc"]):
+            raise Exception("Option link_footprint is only supported for Linux builds with gcc or clang")
+        if self.options.compiler_cache != "none" and \
+                (self.settings.os in ["Macos", "iOS"] or self.settings.compiler == "Visual Studio" or
+                 (self.settings.os == "Windows" and not tools.os_info.is_linux)):
+            raise Exception("Option compiler_cache is only supported for the ./Configure builds of Linux, "
+                            "FreeBSD, SunOS, Android and mingw cross builds")
+        if self.options.benchmark and self.settings.os == "Windows":
+            # The Windows builds produce openssl.exe (Visual Studio in binaries/), run_benchmarks uses apps/openssl
+            raise Exception("Option benchmark is not supported for Windows builds")
+        if self.options.ec_nistp_64_gcc_128:
+            # OpenSSL only supports it on little endian targets tolerating misaligned accesses
+            if self.settings.compiler not in ["clang", "gcc"] or \
+                    str(self.settings.arch) not in ["x86_64", "armv8", "ppc64le"]:
+                raise Exception("Option ec_nistp_64_gcc_128 needs gcc or clang and arch x86_64, armv8 or ppc64le")
+
+    def package_id(self):
+        # The number of make jobs, the compiler cache, the benchmarks, skipping the apps and
+        # rebuilding from scratch do not change the packaged binaries
+        del self.info.options.jobs
+        del self.info.options.compiler_cache
+        del self.info.options.benchmark
+        del self.info.options.libs_only
+        del self.info.options.clean_build
+        # Only the resulting feature set matters, not whether it came from the minimal preset
+        for option_name in self.minimal_features:
+            setattr(self.info.options, option_name, self.feature_disabled(option_name))
+        del self.info.options.minimal
 
     def requirements(self):
         if not self.options.no_zlib:
@@ -68,6 +203,38 @@ class OpenSSLConan(ConanFile):
     def subfolder(self):
         return "openssl-%s" % self.version
 
+    metrics_file = "build_metrics.json"
+
+    @property
+    def build_metrics(self):
+        if not hasattr(self, "_build_metrics"):
+            metrics_path = os.path.join(self.build_folder, self.metrics_file)
+            if os.path.exists(metrics_path):  # package() running after a previous build() call
+                self._build_metrics = json.loads(tools.load(metrics_path))
+            else:
+                self._build_metrics = self.empty_build_metrics()
+        return self._build_metrics
+
+    def empty_build_metrics(self):
+        return {"version": self.version,
+                "cpu_count": tools.cpu_count(),
+                "make_jobs": self.make_jobs,
+                "build_phases": [],
+                "package_phases": []}
+
+    @contextmanager
+    def timed_phase(self, phases, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.build_metrics[phases].append({"name": name, "seconds": round(elapsed, 3)})
+            self.output.info("%s took %.1fs" % (name, elapsed))
+
+    def save_build_metrics(self, folder):
+        tools.save(os.path.join(folder, self.metrics_file), json.dumps(self.build_metrics, indent=4, sort_keys=True))
+
     def build(self):
         """
             For Visual Studio (tried with 2010) compiling need:
@@ -77,6 +244,8 @@ class OpenSSLConan(ConanFile):
             Open the visual 2010 command system symbol and run conan.
             Here are good page explaining it: http://hostagebrain.blogspot.com.es/2015/04/build-openssl-on-windows.html
         """
+        self._build_metrics = self.empty_build_metrics()
+        tools.save(os.path.join(self.build_folder, self.build_log), "")
         config_options_string = ""
         if "zlib" in self.deps_cpp_info.deps:
             zlib_info = self.deps_cpp_info["zlib"]
@@ -88,19 +257,21 @@ class OpenSSLConan(ConanFile):
             config_options_string += ' --with-zlib-include="%s"' % include_path
             config_options_string += ' --with-zlib-lib="%s"' % lib_path
 
-            tools.replace_in_file("./%s/Configure" % self.subfolder, "::-lefence::", "::")
-            tools.replace_in_file("./%s/Configure" % self.subfolder, "::-lefence ", "::")
             self.output.info("=====> Options: %s" % config_options_string)
-        if self.settings.os == "Android" and self.settings.compiler == "clang":
-            tools.replace_in_file("./openssl-%s/Configure" % self.version, 
-                                '''"android-armv7","gcc:-march=armv7-a -mandroid -I\$(ANDROID_DEV)/include -B\$(ANDROID_DEV)/lib -O3 -fomit-frame-pointer -Wall::-D_REENTRANT::-ldl:BN_LLONG RC4_CHAR RC4_CHUNK DES_INT DES_UNROLL BF_PTR:${armv4_asm}:dlfcn:linux-shared:-fPIC::.so.\$(SHLIB_MAJOR).\$(SHLIB_MINOR)",''',
-                                '''"android-armv7","clang:$ENV{'CFLAGS'} -O3 -fomit-frame-pointer -Wall::-D_REENTRANT::-ldl $ENV{'LDFLAGS'}:BN_LLONG RC4_CHAR RC4_CHUNK DES_INT DES_UNROLL BF_PTR:${armv4_asm}:dlfcn:linux-shared:-fPIC::.so.\$(SHLIB_MAJOR).\$(SHLIB_MINOR)",''')
+        self.apply_patches()
+        self.zero_compiler_cache_stats()
 
         for option_name in self.options.values.fields:
+            if option_name in self.recipe_options:
+                continue
             activated = getattr(self.options, option_name)
             if activated:
                 self.output.info("Activated option! %s" % option_name)
                 config_options_string += " %s" % option_name.replace("_", "-")
+        for option_name, (switches, _) in sorted(self.minimal_features.items()):
+            if self.feature_disabled(option_name):
+                self.output.info("Disabled feature! %s" % option_name)
+                config_options_string += " %s" % switches
 
         if self.settings.os in ["Linux", "SunOS", "FreeBSD", "Android"]:
             self.unix_build(config_options_string)
@@ -117,17 +288,317 @@ class OpenSSLConan(ConanFile):
         else:
             raise Exception("Unsupported operating system: %s" % self.settings.os)
 
+        disabled_features = [name for name in self.minimal_features if self.feature_disabled(name)]
+        if disabled_features and self.settings.os in ["Linux", "FreeBSD", "Android"]:
+            self.check_library_footprint()
+
         self.output.info("----------BUILD END-------------")
+        self.report_compiler_cache_stats()
+        if self.options.benchmark:
+            self.run_benchmarks()
+        self.save_build_metrics(self.build_folder)
+
+    def feature_disabled(self, option_name):
+        value = str(getattr(self.options, option_name))
+        if value == "auto":
+            return bool(self.options.minimal)
+        return value == "True"
+
+    @property
+    def toolchain_prefix(self):
+        """ Prefix of the binutils of the toolchain, from CROSS_COMPILE or a CC like aarch64-linux-android-gcc """
+        cross_compile = tools.get_env("CROSS_COMPILE")
+        if cross_compile:
+            return cross_compile
+        cc = shlex.split(tools.get_env("CC", ""))
+        match = re.match(r"^(.*-)(gcc|clang|cc)(-[0-9.]+)?$", os.path.basename(cc[-1])) if cc else None
+        return os.path.join(os.path.dirname(cc[-1]), match.group(1)) if match else ""
+
+    @property
+    def nm(self):
+        # GNU nm cannot read the LLVM bitcode archives of clang LTO builds, llvm-nm reads every target
+        return tools.get_env("NM", "llvm-nm" if self.lto_bitcode_only else "%snm" % self.toolchain_prefix)
+
+    def library_footprint(self, folder):
+        """ Size, exported symbols and relocations of the libcrypto and libssl found in folder,
+            None when the tools cannot read them
+        """
+        nm = self.nm
+        readelf = tools.get_env("READELF", "%sreadelf" % self.toolchain_prefix)
+        if not tools.which(nm):
+            self.output.warn("'%s' not found, cannot measure the libraries" % nm)
+            return None, None
+        try:
+            return self.read_library_footprint(folder, nm, readelf)
+        except (subprocess.CalledProcessError, OSError) as exc:
+            self.output.warn("Could not measure the libraries in %s: %s" % (folder, exc))
+            return None, None
+
+    def read_library_footprint(self, folder, nm, readelf):
+        patterns = ["libcrypto.so.*", "libssl.so.*"] if self.options.shared else ["libcrypto.a", "libssl.a"]
+        footprint, symbols = {}, set()
+        for pattern in patterns:
+            for library in glob.glob(os.path.join(folder, pattern)):
+                if os.path.islink(library):
+                    continue
+                args = [nm, "-g", "--defined-only"] + (["-D"] if self.options.shared else []) + [library]
+                output = subprocess.check_output(args).decode("utf-8", "replace")
+                exported = set(line.split()[-1] for line in output.splitlines() if len(line.split()) == 3)
+                footprint[os.path.basename(library)] = {"size": os.path.getsize(library),
+                                                        "exported_symbols": len(exported)}
+                if tools.which(readelf) and not self.lto_bitcode_only:  # readelf only reads ELF objects
+                    output = subprocess.check_output([readelf, "-r", "-W", library]).decode("utf-8", "replace")
+                    relocations = len(re.findall(r"^[0-9a-f]{8,}\s", output, re.MULTILINE))
+                    footprint[os.path.basename(library)]["relocations"] = relocations
+                symbols.update(exported)
+        return footprint, symbols
+
+    @staticmethod
+    def describe_footprint(footprint):
+        description = "%.2f MB, %d exported symbols" % (footprint["size"] / 1e6, footprint["exported_symbols"])
+        if "relocations" in footprint:
+            description += ", %d relocations" % footprint["relocations"]
+        return description
+
+    def check_library_footprint(self):
+        """ Records the library footprint in the build metrics and, for the features disabled through
+            the minimal preset or the feature options, checks their code is really gone.
+            OPENSSL_FOOTPRINT_BASELINE can point to the build_metrics.json of another build to compare with
+        """
+        footprint, symbols = self.library_footprint(os.path.join(self.build_folder, self.subfolder))
+        if footprint is None:
+            self.output.warn("Skipping the check of the disabled features")
+            return
+        self.build_metrics["library_footprint"] = footprint
+        leftovers = ["%s (%s)" % (option_name, symbol)
+                     for option_name, (_, symbol) in sorted(self.minimal_features.items())
+                     if self.feature_disabled(option_name) and symbol in symbols]
+        if leftovers:
+            raise Exception("Disabled features still present in the libraries: %s" % ", ".join(leftovers))
+
+        baseline_path = tools.get_env("OPENSSL_FOOTPRINT_BASELINE")
+        baseline = json.loads(tools.load(baseline_path)).get("library_footprint", {}) if baseline_path else {}
+        for name, current in sorted(footprint.items()):
+            line = "%s: %s" % (name, self.describe_footprint(current))
+            if name in baseline:
+                line += " (baseline %s)" % self.describe_footprint(baseline[name])
+            self.output.info(line)
+
+    @property
+    def make_jobs(self):
+        # "auto" follows tools.cpu_count(), which can be overridden with the CONAN_CPU_COUNT env var
+        if str(self.options.jobs) == "auto":
+            return tools.cpu_count()
+        try:
+            return max(int(str(self.options.jobs)), 1)
+        except ValueError:
+            raise Exception("Invalid value for option jobs: %s (use 'auto' or a number)" % self.options.jobs)
+
+    @property
+    def parallel_make_safe(self):
+        # The mingw targets are flaky under MSYS/cross make and SunOS may not use GNU make
+        if self.settings.os == "Windows" or self.settings.os == "SunOS":
+            return False
+        return True
+
+    def make_command(self, target="", variables=None, parallel=True):
+        command = "make"
+        if parallel and self.parallel_make_safe and self.make_jobs > 1:
+            command += " -j%d" % self.make_jobs
+        for name, value in sorted((variables or {}).items()):
+            command += ' %s="%s"' % (name, value)
+        if target:
+            command += " %s" % target
+        return command
+
+    def make_commands(self, target="", variables=None):
+        """ In 1.0.2 the shared libraries are linked by re-entering the top level Makefile from crypto/,
+            ssl/ and engines/ ($(MAKE) libcrypto.so ...), which races when those directories build at
+            the same time. Shared builds only compile crypto/, the bulk of the sources, in parallel and
+            finish serially
+        """
+        if not self.options.shared or not self.parallel_make_safe or self.make_jobs == 1:
+            return [self.make_command(target, variables)]
+        return [self.make_command("build_crypto", variables),
+                self.make_command(target, variables, parallel=False)]
+
+    def run_make(self, target="", variables=None, show_output=False):
+        commands = self.make_commands(target, variables)
+        self.output.warn("----------MAKE OPENSSL %s (%s)-------------" % (self.version, " && ".join(commands)))
+        for command in commands:
+            self.run_in_src(command, show_output=show_output)
+
+    @property
+    def compiler_cache(self):
+        if self.options.compiler_cache == "none":
+            return None
+        launcher = str(self.options.compiler_cache)
+        if not tools.which(launcher):
+            raise Exception("Option compiler_cache=%s but '%s' was not found in the PATH" % (launcher, launcher))
+        return launcher
+
+    def compiler_cache_env(self):
+        if self.options.compiler_cache == "sccache":
+            # sccache hashes the command lines as they are, and they carry the absolute build and zlib folders
+            self.output.warn("sccache only gets cache hits for builds in the same build folder, "
+                             "use compiler_cache=ccache to share them between folders")
+        if self.options.compiler_cache != "ccache":
+            return {}
+        # Hash paths relative to the build folder and compare the compiler by content,
+        # so the cache is shared between different build folders and compiler installs
+        return {"CCACHE_BASEDIR": self.build_folder,
+                "CCACHE_NOHASHDIR": "true",
+                "CCACHE_COMPILERCHECK": "content"}
+
+    def compiler_cache_variables(self):
+        """ Make variables putting the cache launcher in front of the CC chosen by ./Configure.
+            CC is overridden in the make command line because the generated Makefile prefixes it
+            with $(CROSS_COMPILE), which would end up in front of the launcher
+        """
+        if not self.compiler_cache:
+            return {}
+        makefile = tools.load(os.path.join(self.subfolder, "Makefile"))
+        cc = re.search(r"^CC=[ \t]*(.*)$", makefile, re.MULTILINE).group(1).strip()
+        cross_compile = re.search(r"^CROSS_COMPILE=[ \t]*(.*)$", makefile, re.MULTILINE)
+        cc = cc.replace("$(CROSS_COMPILE)", cross_compile.group(1).strip() if cross_compile else "")
+        return {"CC": "%s %s" % (self.compiler_cache, cc)}
+
+    @property
+    def lto_flags(self):
+        # gcc keeps regular object code next to the GIMPLE bytecode, so the archives still link without -flto.
+        # clang objects are bitcode only and bfd cannot link them without the LLVMgold plugin, use lld
+        return "-flto -ffat-lto-objects" if self.settings.compiler == "gcc" else "-flto -fuse-ld=lld"
+
+    @property
+    def lto_bitcode_only(self):
+        """ True when the packaged archives hold LLVM bitcode and no machine code """
+        return bool(self.options.lto) and self.settings.compiler == "clang" and not self.options.shared
+
+    def lto_variables(self):
+        """ Make variables switching to archivers that understand the LTO bytecode in the objects
+        """
+        if not self.options.lto:
+            return {}
+        if self.settings.compiler == "gcc":
+            cross_compile = tools.get_env("CROSS_COMPILE", "")
+            return {"AR": "%sgcc-ar r" % cross_compile, "RANLIB": "%sgcc-ranlib" % cross_compile}
+        # The llvm tools handle every target, they have no cross prefixed variants
+        return {"AR": "llvm-ar r", "RANLIB": "llvm-ranlib"}
+
+    def zero_compiler_cache_stats(self):
+        # The statistics are cumulative, zero them so the report only counts this build
+        if not self.compiler_cache:
+            return
+        if self.compiler_cache == "ccache":
+            self.run("ccache -z")
+        else:
+            self.run("sccache --zero-stats")
+
+    def report_compiler_cache_stats(self):
+        if not self.compiler_cache:
+            return
+        self.output.info("----------COMPILER CACHE STATISTICS OF THIS BUILD (%s)-------------" % self.compiler_cache)
+        if self.compiler_cache == "ccache":
+            self.run("ccache -s")
+        else:
+            self.run("sccache --show-stats")
+
+    build_log = "openssl-build.log"
+    log_tail_lines = 200
+    lines_per_progress_dot = 50
 
     def run_in_src(self, command, show_output=False):
-        if not show_output and self.settings.os != "Windows":
-            command += ' | while read line; do printf "%c" .; done'
-            # pipe doesn't fail if first part fails
-            command = 'bash -l -c -o pipefail "%s"' % command.replace('"', '\\"')
-        with tools.chdir(self.subfolder):
-            self.run(command)
+        with self.timed_phase("build_phases", command):
+            if tools.os_info.is_windows:
+                with tools.chdir(self.subfolder):
+                    self.run(command)
+            else:
+                self.stream_in_src(command, show_output)
         self.output.writeln(" ")
 
+    def stream_in_src(self, command, show_output):
+        """ Runs the command without a shell, appending its whole output to the build log.
+            Unless show_output, only a dot every few lines is printed and the last lines
+            are shown if the command fails
+        """
+        args = shlex.split(command)
+        env = dict(os.environ)
+        while args and re.match(r"^\w+=", args[0]):  # VAR=value prefixes, as a shell would take them
+            name, value = args.pop(0).split("=", 1)
+            env[name] = value
+        log_path = os.path.join(self.build_folder, self.build_log)
+        tail = deque(maxlen=self.log_tail_lines)
+        with open(log_path, "a") as log:
+            log.write("$ %s\n" % command)
+            process = subprocess.Popen(args, cwd=os.path.join(self.build_folder, self.subfolder), env=env,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for count, line in enumerate(iter(process.stdout.readline, b""), 1):
+                line = line.decode("utf-8", "replace").rstrip()
+                log.write(line + "\n")
+                tail.append(line)
+                if show_output:
+                    self.output.writeln(line)
+                elif count % self.lines_per_progress_dot == 0:
+                    self.output.write(".")
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            self.output.writeln("")
+            self.output.error("---------- LAST %d LINES OF OUTPUT -------------" % len(tail))
+            for line in tail:
+                self.output.writeln(line)
+            raise Exception("Command '%s' failed with exit code %d, full output in %s" % (command, returncode, log_path))
+
+    def configure_patches(self):
+        """ (file, search, replace) edits of the sources applied before configuring """
+        patches = []
+        if "zlib" in self.deps_cpp_info.deps:
+            patches.append(("Configure", "::-lefence::", "::"))
+            patches.append(("Configure", "::-lefence ", "::"))
+        if self.settings.os == "Android" and self.settings.compiler == "clang":
+            patches.append(("Configure",
+                            '''"android-armv7","gcc:-march=armv7-a -mandroid -I\$(ANDROID_DEV)/include -B\$(ANDROID_DEV)/lib -O3 -fomit-frame-pointer -Wall::-D_REENTRANT::-ldl:BN_LLONG RC4_CHAR RC4_CHUNK DES_INT DES_UNROLL BF_PTR:${armv4_asm}:dlfcn:linux-shared:-fPIC::.so.\$(SHLIB_MAJOR).\$(SHLIB_MINOR)",''',
+                            '''"android-armv7","clang:$ENV{'CFLAGS'} -O3 -fomit-frame-pointer -Wall::-D_REENTRANT::-ldl $ENV{'LDFLAGS'}:BN_LLONG RC4_CHAR RC4_CHUNK DES_INT DES_UNROLL BF_PTR:${armv4_asm}:dlfcn:linux-shared:-fPIC::.so.\$(SHLIB_MAJOR).\$(SHLIB_MINOR)",'''))
+        return patches
+
+    def apply_patches(self):
+        # The stamp records the content the patched files ended with, so a refreshed source tree
+        # does not match it and gets patched again
+        patches = self.configure_patches()
+        filenames = sorted(set(filename for filename, _, _ in patches))
+        if self.stamp_matches("patch", self.stamp_key(repr(patches), *self.tree_hashes(filenames))):
+            return
+        for filename, search, replace in patches:
+            tools.replace_in_file(os.path.join(self.subfolder, filename), search, replace)
+        self.save_stamp("patch", self.stamp_key(repr(patches), *self.tree_hashes(filenames)))
+
+    def tree_hashes(self, filenames):
+        return [self.file_sha256(os.path.join(self.subfolder, filename))
+                if os.path.exists(os.path.join(self.subfolder, filename)) else "" for filename in filenames]
+
+    stamps_folder = ".openssl-stamps"
+
+    @staticmethod
+    def stamp_key(*parts):
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def stamp_matches(self, phase, key):
+        """ True when the phase already completed in this build folder with the same inputs """
+        path = os.path.join(self.build_folder, self.stamps_folder, phase)
+        if os.path.exists(path) and tools.load(path) == key:
+            self.output.info("%s is up to date, skipping it" % phase)
+            self.build_metrics.setdefault("skipped_phases", []).append(phase)
+            return True
+        return False
+
+    def save_stamp(self, phase, key):
+        tools.save(os.path.join(self.build_folder, self.stamps_folder, phase), key)
+
+    def remove_stamp(self, phase):
+        path = os.path.join(self.build_folder, self.stamps_folder, phase)
+        if os.path.exists(path):
+            os.unlink(path)
+
     def unix_build(self, config_options_string):
         env_build = AutoToolsBuildEnvironment(self)
         extra_flags = ' '.join(env_build.flags)
@@ -138,6 +609,13 @@ class OpenSSLConan(ConanFile):
             target_prefix = "debug-"
             if self.settings.compiler in ["apple-clang", "clang", "gcc"]:
                 extra_flags += " -g3 -fno-omit-frame-pointer -fno-inline-functions"
+        elif self.settings.compiler in ["apple-clang", "clang", "gcc"]:
+            # Keep the optimized target and its assembly. 1.0.2 puts these flags in front of the target ones,
+            # so the -O3 of the target is replaced by -Os in the Makefile after ./Configure, see optimize_for_size
+            if self.settings.build_type == "RelWithDebInfo":
+                extra_flags += " -g"
+            elif self.settings.build_type == "MinSizeRel":
+                extra_flags += " -Os"
 
         if self.settings.os == "Linux":
             if self.settings.arch == "x86":
@@ -194,14 +672,302 @@ class OpenSSLConan(ConanFile):
         else:
             raise Exception("Unsupported operating system: %s" % self.settings.os)
 
+        if self.options.compiler_cache == "ccache" and self.settings.compiler in ["clang", "gcc"]:
+            # Keep the absolute build folder out of the debug info so objects are reusable from other folders
+            extra_flags += " -fdebug-prefix-map=%s=." % self.build_folder
+
+        if self.options.lto:
+            extra_flags += " %s" % self.lto_flags
+
+        extra_flags, config_options_string = self.cpu_tuning(extra_flags, config_options_string)
+
+        if self.options.link_footprint:
+            # Sections per function/object so linkers can drop unused code, and the shared libraries
+            # bind their own functions at link time instead of through the PLT
+            extra_flags += " -ffunction-sections -fdata-sections"
+            if self.options.shared:
+                extra_flags += " -Wl,-Bsymbolic-functions -Wl,--gc-sections"
+
+        if self.options.pgo:
+            self.pgo_build(config_options_string, target, extra_flags)
+        else:
+            self.configure_and_make(config_options_string, target, extra_flags)
+
+    def cpu_tuning(self, extra_flags, config_options_string):
+        """ Adds -march and the 128 bits integer nistp implementations of P-224/P-256/P-521,
+            after checking the compiler accepts them
+        """
+        tuning = str(self.options.cpu_tuning)
+        if tuning != "baseline":
+            march = "-march=%s" % tuning
+            if not self.compiler_accepts("%s %s" % (extra_flags, march), "int main(void) { return 0; }"):
+                raise Exception("The compiler does not support %s" % march)
+            if tuning == "native":
+                self.output.warn("cpu_tuning=native, the package will only run on CPUs like the build machine")
+            extra_flags += " %s" % march
+        if self.options.ec_nistp_64_gcc_128:
+            int128 = "typedef unsigned __int128 u128; u128 mul(u128 a, u128 b) { return a * b; }"
+            if not self.compiler_accepts(extra_flags, int128):
+                raise Exception("Option ec_nistp_64_gcc_128 needs a compiler with __int128 support")
+            config_options_string += " enable-ec_nistp_64_gcc_128"
+        self.output.info("CPU tuning: %s, ec_nistp_64_gcc_128: %s" % (tuning, self.options.ec_nistp_64_gcc_128))
+        self.build_metrics["cpu_tuning"] = tuning
+        self.build_metrics["ec_nistp_64_gcc_128"] = bool(self.options.ec_nistp_64_gcc_128)
+        return extra_flags, config_options_string
+
+    def compiler_accepts(self, flags, code):
+        compiler = tools.get_env("CC") or str(self.settings.compiler)
+        source = os.path.join(self.build_folder, "compiler_check.c")
+        tools.save(source, code + "\n")
+        with open(os.devnull, "w") as devnull:
+            returncode = subprocess.call(shlex.split(compiler) + shlex.split(flags) +
+                                         ["-c", source, "-o", os.devnull], stdout=devnull, stderr=devnull)
+        os.unlink(source)
+        return returncode == 0
+
+    def configure_and_make(self, config_options_string, target, extra_flags):
         config_line = "./Configure %s -fPIC %s %s" % (config_options_string, target, extra_flags)
+        self.build_metrics["target"] = target
+        self.build_metrics["config_line"] = config_line
 
+        # Configure regenerates the Makefiles and opensslconf.h, which would rebuild everything,
+        # so it and make depend only run again when their inputs changed
+        zlib_folder = self.deps_cpp_info["zlib"].rootpath if "zlib" in self.deps_cpp_info.deps else ""
+        key = self.stamp_key(config_line, repr(self.configure_patches()), zlib_folder)
+        # Also keyed on the Makefile ./Configure generated, a refreshed source tree has the pristine one
         self.output.warn(config_line)
-        self.run_in_src(config_line)
-        if not tools.cross_building(self.settings):
+        if self.options.clean_build or \
+                not self.stamp_matches("configure", self.stamp_key(key, *self.tree_hashes(["Makefile"]))):
+            if os.path.exists(os.path.join(self.build_folder, self.stamps_folder, "configure")):
+                # Objects from a different configuration, or a clean build was asked
+                self.output.warn("----------REBUILDING OPENSSL FROM SCRATCH-------------")
+                self.run_in_src("make clean")
+            self.remove_stamp("depend")
+            self.run_in_src(config_line)
+            self.optimize_for_size()
+            self.save_stamp("configure", self.stamp_key(key, *self.tree_hashes(["Makefile"])))
+        if self.make_depend_needed(config_options_string) and not self.stamp_matches("depend", key):
+            # make depend rewrites the Makefiles in place, never run it in parallel
             self.run_in_src("make depend")
-        self.output.warn("----------MAKE OPENSSL %s-------------" % self.version)
-        self.run_in_src("make", show_output=True)
+            self.save_stamp("depend", key)
+        make_variables = self.compiler_cache_variables()
+        make_variables.update(self.lto_variables())
+        with tools.environment_append(self.compiler_cache_env()):
+            self.run_make(self.make_targets, variables=make_variables, show_output=True)
+
+    def optimize_for_size(self):
+        """ ./Configure of 1.0.2 builds CFLAG as the user flags followed by the target ones, so the
+            -O3 of the target wins over a -Os given to it. MinSizeRel puts -Os in place of the
+            optimization levels of the generated Makefile instead
+        """
+        if self.settings.build_type != "MinSizeRel":
+            return
+        makefile = os.path.join(self.build_folder, self.subfolder, "Makefile")
+        content = tools.load(makefile)
+        cflag = re.search(r"^CFLAG=(.*)$", content, re.MULTILINE)
+        flags = [flag for flag in cflag.group(1).split() if not re.match(r"^-O[0-9s]?$", flag)]
+        new_cflag = "CFLAG= %s -Os" % " ".join(flags)
+        self.output.info("MinSizeRel: %s" % new_cflag)
+        tools.save(makefile, content[:cflag.start()] + new_cflag + content[cflag.end():])
+
+    # ./Configure switches that keep the default set of algorithms, so the dependencies
+    # shipped in the Makefiles of the tarball are still valid
+    depend_neutral_switches = ["no-asm", "no-sse2", "no-threads", "no-zlib", "no-shared"]
+
+    def make_depend_needed(self, config_options_string):
+        if tools.cross_building(self.settings):
+            return False
+        if not self.options.libs_only:
+            return True
+        switches = [switch for switch in config_options_string.split()
+                    if switch.startswith(("no-", "enable-")) and switch not in self.depend_neutral_switches]
+        if switches:
+            self.output.info("make depend needed for %s" % " ".join(switches))
+        return bool(switches)
+
+    @property
+    def make_targets(self):
+        """ 1.0.2 top level targets building only what package() ships, plus apps/openssl
+            when it is needed to train PGO or run the benchmarks
+        """
+        if not self.options.libs_only:
+            return ""
+        if self.options.pgo or self.options.benchmark:
+            return "build_libs build_apps"
+        return "build_libs"
+
+    def pgo_build(self, config_options_string, target, extra_flags):
+        """ Instrumented build, training with the freshly built apps/openssl and rebuild using the profile
+        """
+        if tools.cross_building(self.settings):
+            raise Exception("Option pgo needs to run the instrumented openssl, it is not available when cross building")
+        profile_dir = os.path.join(self.build_folder, "pgo-profile")
+        tools.rmdir(profile_dir)
+        os.makedirs(profile_dir)
+
+        self.output.warn("----------PGO: INSTRUMENTED BUILD-------------")
+        self.configure_and_make(config_options_string, target, "%s -fprofile-generate=%s" % (extra_flags, profile_dir))
+        self.output.warn("----------PGO: TRAINING-------------")
+        self.pgo_training()
+
+        if self.settings.compiler == "clang":
+            profile_data = os.path.join(profile_dir, "default.profdata")
+            self.run('llvm-profdata merge -output="%s" "%s"' % (profile_data, profile_dir))
+            use_flags = "-fprofile-use=%s" % profile_data
+        else:
+            use_flags = "-fprofile-use=%s -fprofile-correction" % profile_dir
+
+        self.output.warn("----------PGO: OPTIMIZED BUILD-------------")
+        # The new flags change the configure stamp, so the instrumented objects are cleaned first
+        self.configure_and_make(config_options_string, target, "%s %s" % (extra_flags, use_flags))
+
+    def pgo_training(self):
+        # Bulk crypto the TLS termination spends its time in, then real handshakes over loopback
+        openssl = self.openssl_app
+        with tools.environment_append(self.openssl_app_env()):
+            self.run_in_src("%s speed -evp aes-128-gcm" % openssl)
+            self.run_in_src("%s speed -evp aes-256-gcm" % openssl)
+            algorithms = self.enabled_speed_algorithms(["sha256", "sha512", "rsa2048", "ecdhp256"])
+            if algorithms:
+                self.run_in_src("%s speed %s" % (openssl, " ".join(algorithms)))
+
+            if self.options.no_sha or self.options.no_hmac:
+                self.output.warn("TLS needs SHA and HMAC, skipping the handshake training")
+                return
+            # Without RSA the server authenticates with an ECDSA P-256 certificate
+            if self.options.no_rsa:
+                new_key, cipher = "ec -pkeyopt ec_paramgen_curve:P-256", "ECDHE-ECDSA-AES128-GCM-SHA256"
+            else:
+                new_key, cipher = "rsa:2048", "ECDHE-RSA-AES128-GCM-SHA256"
+            self.run_in_src("%s req -config apps/openssl.cnf -x509 -newkey %s -nodes -days 1 -subj /CN=localhost "
+                            "-keyout pgo-key.pem -out pgo-cert.pem" % (openssl, new_key))
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            sock.close()
+            with open(os.devnull, "w") as devnull:
+                server = subprocess.Popen([openssl, "s_server", "-quiet", "-www", "-accept", str(port),
+                                           "-cert", "pgo-cert.pem", "-key", "pgo-key.pem"],
+                                          cwd=os.path.join(self.build_folder, self.subfolder),
+                                          stdin=subprocess.PIPE, stdout=devnull, stderr=devnull)
+                try:
+                    self.wait_for_port(port)
+                    self.run_in_src("%s s_time -connect 127.0.0.1:%d -new -time 10 -cipher %s"
+                                    % (openssl, port, cipher))
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    @property
+    def openssl_app(self):
+        return os.path.join(self.build_folder, self.subfolder, "apps", "openssl")
+
+    def openssl_app_env(self):
+        # Let apps/openssl find the shared libraries of the build folder
+        lib_dir = os.path.join(self.build_folder, self.subfolder)
+        return {"LD_LIBRARY_PATH": lib_dir, "DYLD_LIBRARY_PATH": lib_dir}
+
+    @staticmethod
+    def wait_for_port(port, timeout=30):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except socket.error:
+                if time.time() > deadline:
+                    raise Exception("openssl s_server did not start listening on port %d" % port)
+                time.sleep(0.2)
+
+    benchmark_file = "benchmark.json"
+    # 'openssl speed' algorithms -> options removing what speed needs to run them.
+    # ECDH depends on no-ec/no-ecdh, which the recipe has no option for, not on no-dh
+    speed_algorithm_options = {"sha1": ["no_sha", "no_hmac"],
+                               "sha256": ["no_sha", "no_hmac"],
+                               "sha512": ["no_sha", "no_hmac"],
+                               "rsa2048": ["no_rsa"],
+                               "ecdhp256": [],
+                               "rc4": ["no_rc4"]}
+
+    def enabled_speed_algorithms(self, algorithms):
+        enabled = [algorithm for algorithm in algorithms
+                   if not any(getattr(self.options, option_name)
+                              for option_name in self.speed_algorithm_options.get(algorithm, []))]
+        if len(enabled) != len(algorithms):
+            self.output.warn("Skipping disabled algorithms: %s" % " ".join(sorted(set(algorithms) - set(enabled))))
+        return enabled
+
+    def run_benchmarks(self):
+        """ Measures the built openssl with 'openssl speed' and writes benchmark.json.
+            OPENSSL_BENCHMARK_MULTI runs speed with -multi, OPENSSL_BENCHMARK_BASELINE points to a
+            previous benchmark.json and fails the build when any result is more than
+            OPENSSL_BENCHMARK_TOLERANCE percent (default 10) slower
+        """
+        if tools.cross_building(self.settings):
+            self.output.warn("Cross building, skipping the benchmarks")
+            return
+        if not os.path.exists(self.openssl_app):
+            raise Exception("Option benchmark needs the openssl application, not found in %s" % self.openssl_app)
+
+        self.output.warn("----------BENCHMARK OPENSSL %s-------------" % self.version)
+        multi = int(tools.get_env("OPENSSL_BENCHMARK_MULTI", default="1"))
+        speed = ["speed", "-mr"] + (["-multi", str(multi)] if multi > 1 else [])
+        algorithms = self.enabled_speed_algorithms(["sha1", "sha256", "sha512", "rsa2048", "ecdhp256", "rc4"])
+        runs = [speed + ["-evp", "aes-128-gcm"], speed + ["-evp", "aes-256-gcm"]]
+        if algorithms:
+            runs.append(speed + algorithms)
+
+        report = {"version": self.openssl_output(["version", "-a"]).strip(), "multi": multi, "results": {}}
+        compiler_line = [line for line in report["version"].splitlines() if line.startswith("compiler:")]
+        # A build that lost its perlasm paths has no *_ASM defines left
+        report["asm_defines"] = sorted(set(re.findall(r"-D(\w+_ASM\w*)", "".join(compiler_line))))
+        for args in runs:
+            with self.timed_phase("build_phases", "openssl %s" % " ".join(args)):
+                report["results"].update(self.parse_speed_output(self.openssl_output(args)))
+        for name, value in sorted(report["results"].items()):
+            self.output.info("%-20s %14.2f %s" % (name, value["value"], value["unit"]))
+        tools.save(os.path.join(self.build_folder, self.benchmark_file), json.dumps(report, indent=4, sort_keys=True))
+        self.check_benchmark_baseline(report)
+
+    def openssl_output(self, args):
+        with tools.environment_append(self.openssl_app_env()):
+            output = subprocess.check_output([self.openssl_app] + args, cwd=os.path.join(self.build_folder, self.subfolder))
+        return output.decode("utf-8", "replace")
+
+    @staticmethod
+    def parse_speed_output(output):
+        """ Parses the machine readable (-mr) lines of 'openssl speed' """
+        results = {}
+        for line in output.splitlines():
+            fields = line.strip().split(":")
+            if fields[0] == "+F":  # ciphers and digests, bytes per second for each block size
+                results[fields[2]] = {"value": float(fields[-1]) / 1e6, "unit": "MB/s"}
+            elif fields[0] == "+F2":  # rsa, seconds per sign and verify
+                results["rsa%s sign" % fields[2]] = {"value": 1 / float(fields[3]), "unit": "ops/s"}
+                results["rsa%s verify" % fields[2]] = {"value": 1 / float(fields[4]), "unit": "ops/s"}
+            elif fields[0] == "+F5":  # ecdh, seconds per operation
+                results["ecdh%s" % fields[2]] = {"value": 1 / float(fields[3]), "unit": "ops/s"}
+        return results
+
+    def check_benchmark_baseline(self, report):
+        baseline_path = tools.get_env("OPENSSL_BENCHMARK_BASELINE")
+        if not baseline_path:
+            return
+        tolerance = float(tools.get_env("OPENSSL_BENCHMARK_TOLERANCE", default="10"))
+        baseline = json.loads(tools.load(baseline_path))
+        regressions = []
+        for name, value in sorted(report["results"].items()):
+            if name not in baseline["results"]:
+                continue
+            expected = baseline["results"][name]["value"]
+            drop = (expected - value["value"]) * 100.0 / expected
+            if drop > tolerance:
+                regressions.append("%s: %.2f %s, baseline %.2f (-%.1f%%)"
+                                   % (name, value["value"], value["unit"], expected, drop))
+        if regressions:
+            raise Exception("Throughput regressed more than %s%% against %s:\n%s"
+                            % (tolerance, baseline_path, "\n".join(regressions)))
+        self.output.info("Benchmarks within %s%% of %s" % (tolerance, baseline_path))
 
     def ios_build(self, config_options_string):
         def find_sysroot(sdk_name):
@@ -224,6 +990,8 @@ class OpenSSLConan(ConanFile):
         os.environ["CROSS_TOP"] = os.path.dirname(os.path.dirname(sysroot))
 
         command = 'CC="%s" %s' % (cc, command)
+        self.build_metrics["target"] = "iphoneos-cross"
+        self.build_metrics["config_line"] = command
 
         self.run_in_src(command)
         # REPLACE -install_name FOR FOLLOW THE CONAN RULES,
@@ -231,15 +999,18 @@ class OpenSSLConan(ConanFile):
         old_str = 'SHAREDFLAGS="$$SHAREDFLAGS -install_name $(INSTALLTOP)/$(LIBDIR)/$$SHLIB$'
         new_str = 'SHAREDFLAGS="$$SHAREDFLAGS -install_name $$SHLIB$'
         tools.replace_in_file("./%s/Makefile.shared" % self.subfolder, old_str, new_str)
-        self.output.warn("----------MAKE OPENSSL %s-------------" % self.version)
-        self.run_in_src("make")
+        self.run_make()
 
     def osx_build(self, config_options_string):
         m32_suff = " -m32" if self.settings.arch == "x86" else ""
         if self.settings.arch == "x86_64":
-            command = "./Configure darwin64-x86_64-cc %s" % config_options_string
+            target = "darwin64-x86_64-cc"
+            command = "./Configure %s %s" % (target, config_options_string)
         else:
+            target = "./config"  # config guesses the target itself
             command = "./config %s %s" % (config_options_string, m32_suff)
+        self.build_metrics["target"] = target
+        self.build_metrics["config_line"] = command
 
         self.run_in_src(command)
         # REPLACE -install_name FOR FOLLOW THE CONAN RULES,
@@ -247,8 +1018,7 @@ class OpenSSLConan(ConanFile):
         old_str = 'SHAREDFLAGS="$$SHAREDFLAGS -install_name $(INSTALLTOP)/$(LIBDIR)/$$SHLIB$'
         new_str = 'SHAREDFLAGS="$$SHAREDFLAGS -install_name $$SHLIB$'
         tools.replace_in_file("./%s/Makefile.shared" % self.subfolder, old_str, new_str)
-        self.output.warn("----------MAKE OPENSSL %s-------------" % self.version)
-        self.run_in_src("make")
+        self.run_make()
 
     def visual_build_(self, config_options_string):
         self.run_in_src("perl --version")
@@ -261,6 +1031,8 @@ class OpenSSLConan(ConanFile):
         
         config_command = "perl Configure %s %s --prefix=../binaries" % (configure_type, no_asm)
         whole_command = "%s %s" % (config_command, config_options_string)
+        self.build_metrics["target"] = configure_type
+        self.build_metrics["config_line"] = whole_command
         self.output.warn(whole_command)
         self.run_in_src(whole_command)
 
@@ -332,45 +1104,112 @@ class OpenSSLConan(ConanFile):
     def mingw_build(self, config_options_string):
         # https://netix.dl.sourceforge.net/project/msys2/Base/x86_64/msys2-x86_64-20161025.exe
         config_options_string = tools.unix_path(config_options_string)
-        if self.settings.build_type == "Debug":
+        if self.settings.build_type in ["Debug", "RelWithDebInfo"]:
             config_options_string = "-g " + config_options_string
+        elif self.settings.build_type == "MinSizeRel":
+            config_options_string = "-Os " + config_options_string
         if self.settings.arch == "x86":
             config_line = "./Configure mingw %s" % config_options_string
         else:
             config_line = "./Configure mingw64 %s" % config_options_string
+        self.build_metrics["target"] = config_line.split()[1]
+        self.build_metrics["config_line"] = config_line
         self.output.warn(config_line)
         with tools.chdir(self.subfolder):
-            tools.run_in_windows_bash(self, config_line)
-            self.output.warn("----------MAKE OPENSSL %s-------------" % self.version)
+            with self.timed_phase("build_phases", config_line):
+                tools.run_in_windows_bash(self, config_line)
+            self.optimize_for_size()
+            self.output.warn("----------MAKE OPENSSL %s (%s)-------------" % (self.version, self.make_command()))
             # tools.run_in_windows_bash(self, "make depend")
-            tools.run_in_windows_bash(self, "make")
+            with self.timed_phase("build_phases", self.make_command()):
+                tools.run_in_windows_bash(self, self.make_command())
 
     def package(self):
         # Copy the license files
-        self.copy("%s/LICENSE" % self.subfolder, keep_path=False)
-        self.copy(pattern="*applink.c", dst="include/openssl/", keep_path=False)
-        if self.settings.os == "Windows" and self.settings.compiler == "Visual Studio":
-            self._copy_visual_binaries()
-            self.copy(pattern="*.h", dst="include/openssl/", src="binaries/include/", keep_path=False)
-        elif self.settings.os == "Windows" and self.settings.compiler == "gcc":
-            self.copy(pattern="%s/include/*" % self.subfolder, dst="include/openssl/", keep_path=False)
-            if self.options.shared:
-                self.copy(pattern="%s/libcrypto.dll.a" % self.subfolder, dst="lib", keep_path=False)
-                self.copy(pattern="%s/libssl.dll.a" % self.subfolder, dst="lib", keep_path=False)
-                self.copy(pattern="%s/libeay32.dll" % self.subfolder, dst="bin", keep_path=False)
-                self.copy(pattern="%s/ssleay32.dll" % self.subfolder, dst="bin", keep_path=False)
+        with self.timed_phase("package_phases", "license"):
+            self.copy("%s/LICENSE" % self.subfolder, keep_path=False)
+        with self.timed_phase("package_phases", "libraries"):
+            if self.settings.os == "Windows" and self.settings.compiler == "Visual Studio":
+                self._copy_visual_binaries()
+            elif self.settings.os == "Windows" and self.settings.compiler == "gcc":
+                if self.options.shared:
+                    self.copy(pattern="%s/libcrypto.dll.a" % self.subfolder, dst="lib", keep_path=False)
+                    self.copy(pattern="%s/libssl.dll.a" % self.subfolder, dst="lib", keep_path=False)
+                    self.copy(pattern="%s/libeay32.dll" % self.subfolder, dst="bin", keep_path=False)
+                    self.copy(pattern="%s/ssleay32.dll" % self.subfolder, dst="bin", keep_path=False)
+                else:
+                    self.copy(pattern="%s/libcrypto.a" % self.subfolder, dst="lib", keep_path=False)
+                    self.copy(pattern="%s/libssl.a" % self.subfolder, dst="lib", keep_path=False)
             else:
-                self.copy(pattern="%s/libcrypto.a" % self.subfolder, dst="lib", keep_path=False)
-                self.copy(pattern="%s/libssl.a" % self.subfolder, dst="lib", keep_path=False)
-        else:
+                if self.options.shared:
+                    self.copy(pattern="*libcrypto*.dylib", dst="lib", keep_path=False)
+                    self.copy(pattern="*libssl*.dylib", dst="lib", keep_path=False)
+                    self.copy(pattern="*libcrypto.so*", dst="lib", keep_path=False)
+                    self.copy(pattern="*libssl.so*", dst="lib", keep_path=False)
+                else:
+                    self.copy("*.a", "lib", keep_path=False)
+        with self.timed_phase("package_phases", "headers"):
+            self.copy(pattern="*applink.c", dst="include/openssl/", keep_path=False)
+            if self.settings.os == "Windows" and self.settings.compiler == "Visual Studio":
+                self.copy(pattern="*.h", dst="include/openssl/", src="binaries/include/", keep_path=False)
+            else:
+                self.copy(pattern="%s/include/*" % self.subfolder, dst="include/openssl/", keep_path=False)
+        if self.settings.build_type == "RelWithDebInfo" and self.settings.os in ["Linux", "Android", "FreeBSD"]:
+            with self.timed_phase("package_phases", "debug symbols"):
+                self.split_debug_info()
+        if self.options.link_footprint:
+            with self.timed_phase("package_phases", "strip"):
+                self.strip_packaged_libraries()
+        self.copy(self.benchmark_file)
+        self.save_build_metrics(self.package_folder)
+
+    def split_debug_info(self):
+        """ Moves the debug info of the packaged libraries to lib/.debug. gdb finds the one of the shared
+            libraries through their .gnu_debuglink section, the .a.debug archives hold the debug info
+            of each member of the static archives
+        """
+        if self.lto_bitcode_only:
+            self.output.warn("The archives are LLVM bitcode, keeping their debug info in place")
+            return
+        objcopy = tools.get_env("OBJCOPY", "objcopy")
+        lib_dir = os.path.join(self.package_folder, "lib")
+        debug_dir = os.path.join(lib_dir, ".debug")
+        if not os.path.isdir(debug_dir):
+            os.makedirs(debug_dir)
+        pattern = "*.so*" if self.options.shared else "*.a"
+        for library in glob.glob(os.path.join(lib_dir, pattern)):
+            if os.path.islink(library):
+                continue
+            debug_file = os.path.join(debug_dir, os.path.basename(library) + ".debug")
+            self.run('%s --only-keep-debug "%s" "%s"' % (objcopy, library, debug_file))
             if self.options.shared:
-                self.copy(pattern="*libcrypto*.dylib", dst="lib", keep_path=False)
-                self.copy(pattern="*libssl*.dylib", dst="lib", keep_path=False)
-                self.copy(pattern="*libcrypto.so*", dst="lib", keep_path=False)
-                self.copy(pattern="*libssl.so*", dst="lib", keep_path=False)
+                self.run('%s --strip-debug --add-gnu-debuglink="%s" "%s"' % (objcopy, debug_file, library))
             else:
-                self.copy("*.a", "lib", keep_path=False)
-            self.copy(pattern="%s/include/*" % self.subfolder, dst="include/openssl/", keep_path=False)
+                self.run('%s --strip-debug "%s"' % (objcopy, library))
+            self.output.info("Debug info of %s in %s" % (os.path.basename(library), debug_file))
+
+    def strip_packaged_libraries(self):
+        strip = tools.get_env("STRIP", "strip")
+        lib_dir = os.path.join(self.package_folder, "lib")
+        if self.lto_bitcode_only:
+            self.output.warn("The archives are LLVM bitcode, strip cannot process them")
+        else:
+            for library in glob.glob(os.path.join(lib_dir, "lib*")):
+                if not os.path.islink(library) and os.path.isfile(library):
+                    self.run('%s --strip-unneeded "%s"' % (strip, library))
+
+        built, _ = self.library_footprint(os.path.join(self.build_folder, self.subfolder))
+        packaged, _ = self.library_footprint(lib_dir)
+        if built is None or packaged is None:
+            return
+        self.build_metrics["packaged_footprint"] = packaged
+        for name, footprint in sorted(packaged.items()):
+            if name in built:
+                saved = 100.0 * (built[name]["size"] - footprint["size"]) / built[name]["size"]
+                line = "%s: %s (%.1f%% smaller than built" % (name, self.describe_footprint(footprint), saved)
+                if "relocations" in footprint and "relocations" in built[name]:
+                    line += ", %d relocations when built" % built[name]["relocations"]
+                self.output.info(line + ")")
 
     def _copy_visual_binaries(self):
         self.copy(pattern="*.lib", dst="lib", src="binaries/lib", keep_path=False)
@@ -395,3 +1234,18 @@ class OpenSSLConan(ConanFile):
             self.cpp_info.libs = ["ssl", "crypto", "dl"]
         else:
             self.cpp_info.libs = ["ssl", "crypto"]
+
+        if self.options.link_footprint and not self.options.shared:
+            # Lets the consumers drop the unused sections of the static archives
+            self.cpp_info.exelinkflags.append("-Wl,--gc-sections")
+            self.cpp_info.sharedlinkflags.append("-Wl,--gc-sections")
+
+        if self.options.lto:
+            # The objects carry LTO bytecode of this compiler, link with -flto to optimize across OpenSSL calls
+            self.user_info.lto_bitcode = str(self.settings.compiler)
+            if self.lto_bitcode_only:
+                # No machine code in the archives, consumers must link them with clang -flto and lld/gold
+                self.user_info.lto_bitcode_only = "True"
+            if not self.options.shared:
+                self.cpp_info.exelinkflags.append("-flto")
+                self.cpp_info.sharedlinkflags.append("-flto")